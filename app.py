@@ -1,185 +1,51 @@
 import streamlit as st
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-import datetime
 import time
 
+from helpers import (
+    POINTS_BY_ATTEMPTS,
+    answers_index,
+    canonical_names,
+    check_writes,
+    connect_to_sheet,
+    fetch_user_history,
+    flush_writes,
+    flush_writes_if_due,
+    reference_tables,
+    render_sidebar,
+    reset_mode1_answers,
+    save_mode1_session,
+    save_mode2_guess,
+)
+
 # --- SETUP PAGE CONFIG ---
 st.set_page_config(page_title="Bible Character Quiz", page_icon="📖", layout="wide")
 
-# --- CONNECT TO GOOGLE SHEETS ---
-@st.cache_resource
-def connect_to_sheet():
-    # Attempt to load from Streamlit Secrets (for Cloud Deployment)
-    if "gcp_service_account" in st.secrets:
-        creds_dict = dict(st.secrets["gcp_service_account"])
-        creds = ServiceAccountCredentials.from_json_keyfile_dict(
-            creds_dict, 
-            ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-        )
-    # Fallback to local file (for Local Testing)
-    else:
-        scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-        creds = ServiceAccountCredentials.from_json_keyfile_name("credentials.json", scope)
-    
-    client = gspread.authorize(creds)
-    return client.open("Bible Character Game  - Python")
-
 # --- INITIALIZE SESSION STATE ---
-if 'page' not in st.session_state:
-    st.session_state.page = 'home'
-if 'score' not in st.session_state:
-    st.session_state.score = 0
-if 'user_id' not in st.session_state:
-    st.session_state.user_id = "" # Stores "Name_PIN"
-if 'display_name' not in st.session_state:
-    st.session_state.display_name = ""
+st.session_state.setdefault('page', 'home')
+st.session_state.setdefault('score', 0)
+st.session_state.setdefault('user_id', "") # Stores "Name_PIN"
+st.session_state.setdefault('display_name', "")
 
 # History State (To remember what is finished)
-if 'history_mode1' not in st.session_state:
-    st.session_state.history_mode1 = {} # { 'cat_id': best_score }
-if 'history_mode2' not in st.session_state:
-    st.session_state.history_mode2 = [] 
+st.session_state.setdefault('history_mode1', {}) # { 'cat_id': best_score }
+st.session_state.setdefault('history_mode2', [])
+st.session_state.setdefault('cat_view', None) # (categories, [(cat, best, is_complete), ...]) for mode1_select
 
 # Game Specifics
-if 'm1_answers' not in st.session_state:
-    st.session_state.m1_answers = []
-if 'current_category' not in st.session_state:
-    st.session_state.current_category = None
-if 'm2_progress' not in st.session_state:
-    st.session_state.m2_progress = {} 
-
-# --- HELPER FUNCTIONS ---
+st.session_state.setdefault('m1_answers', [])
+st.session_state.setdefault('m1_answers_lower', set()) # Lowercased copy of m1_answers for duplicate checks
+st.session_state.setdefault('current_category', None)
+st.session_state.setdefault('valid_answers', {}) # { lowercased answer: display name } for current_category
+st.session_state.setdefault('m2_progress', {})
+st.session_state.setdefault('m2_index', 0) # Character currently shown in Mode 2
 
-def fetch_user_history(sheet, user_id):
-    """
-    Calculates Total Score from Database and loads progress.
-    """
-    total_calculated_score = 0
-    
-    # 1. Fetch Mode 1 History & Score
-    try:
-        m1_sheet = sheet.worksheet("Mode1_Sessions")
-        m1_data = m1_sheet.get_all_records()
-        
-        # Filter for current user
-        user_m1 = [r for r in m1_data if str(r['UserEmail']) == user_id]
-        history_map = {}
-        
-        for row in user_m1:
-            c_id = str(row['CategoryID'])
-            try:
-                score = int(row['Score'])
-            except:
-                score = 0
-                
-            # Keep only the highest score achieved per category
-            if c_id not in history_map or score > history_map[c_id]:
-                history_map[c_id] = score
-        
-        st.session_state.history_mode1 = history_map
-        # Add Mode 1 points to total
-        total_calculated_score += sum(history_map.values())
-        
-    except Exception:
-        pass 
-
-    # 2. Fetch Mode 2 History & Score
-    try:
-        m2_sheet = sheet.worksheet("Mode2_Sessions")
-        m2_data = m2_sheet.get_all_records()
-        
-        # Filter: Matches User AND IsSolved = TRUE
-        user_m2 = [r for r in m2_data if str(r['UserEmail']) == user_id and str(r['IsSolved']).upper() == "TRUE"]
-        
-        solved_chars = set()
-        m2_points = 0
-        
-        for row in user_m2:
-            c_id = str(row['CharacterID'])
-            if c_id not in solved_chars:
-                solved_chars.add(c_id)
-                
-                try:
-                    attempts = int(row['CurrentAttempts'])
-                except:
-                    attempts = 2 # Default to 1pt if data error
-                
-                # Scoring Logic: 0 attempts=3pts, 1 attempt=2pts, >=2 attempts=1pt
-                if attempts == 0:
-                    m2_points += 3
-                elif attempts == 1:
-                    m2_points += 2
-                else:
-                    m2_points += 1
-                    
-        total_calculated_score += m2_points
-        
-        # Pre-fill m2_progress so UI shows "Solved" immediately
-        for c_id in solved_chars:
-             if c_id not in st.session_state.m2_progress:
-                 st.session_state.m2_progress[c_id] = {'attempts': 0, 'solved': True}
-             else:
-                 st.session_state.m2_progress[c_id]['solved'] = True
-
-    except Exception:
-        pass
-
-    # SET THE GLOBAL SCORE
-    st.session_state.score = total_calculated_score
-
-def save_mode1_session(sheet, category_id, score, answers):
-    session_sheet = sheet.worksheet("Mode1_Sessions")
-    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    session_id = f"SESS-{int(time.time())}"
-    
-    # Use user_id (Name_PIN) for storage
-    row_data = [session_id, category_id, st.session_state.user_id, timestamp, score] + answers
-    while len(row_data) < 20: 
-        row_data.append("")
-    session_sheet.append_row(row_data)
-
-def save_mode2_guess(sheet, char_id, attempts, solved, guess):
-    session_sheet = sheet.worksheet("Mode2_Sessions")
-    guess_id = f"GUESS-{int(time.time())}-{char_id}"
-    row_data = [guess_id, char_id, st.session_state.user_id, attempts, str(solved).upper(), guess]
-    session_sheet.append_row(row_data)
-
-# --- NAVIGATION SIDEBAR ---
-
-def render_sidebar():
-    if st.session_state.user_id:
-        with st.sidebar:
-            st.header(f"👤 {st.session_state.display_name}")
-            st.caption(f"ID: {st.session_state.user_id}")
-            st.metric("TOTAL SCORE", st.session_state.score)
-            
-            st.divider()
-            st.subheader("Navigation")
-            
-            if st.button("🏠 Home", use_container_width=True):
-                st.session_state.page = 'menu'
-                st.rerun()
-
-            if st.button("📂 Name All by Category", use_container_width=True):
-                st.session_state.page = 'mode1_select'
-                st.session_state.m1_answers = [] 
-                st.rerun()
-
-            if st.button("🕵️ Guess the Character", use_container_width=True):
-                st.session_state.page = 'mode2_play'
-                st.rerun()
-                
-            st.divider()
-            
-            if st.button("Log Out", type="secondary", use_container_width=True):
-                for key in list(st.session_state.keys()):
-                    del st.session_state[key]
-                st.rerun()
+# Write Buffer
+st.session_state.setdefault('pending_writes', {}) # { 'sheet_title': [row, ...] }
+st.session_state.setdefault('write_futures', []) # (future, sheet_title, rows) for appends still in flight
 
 # --- PAGES ---
 
-def home_page(sheet):
+def home_page():
     st.title("📖 Bible Characters Quiz")
     st.write("Enter your Name and a secret PIN to access your game.")
     
@@ -199,7 +65,12 @@ def home_page(sheet):
             
             # Load previous progress
             with st.spinner("Loading your score..."):
-                fetch_user_history(sheet, unique_id)
+                fetch_user_history(unique_id)
+                # Warm the shared game content too, so the first page after login doesn't wait on Sheets
+                try:
+                    reference_tables()
+                except Exception:
+                    pass # The pages report the error themselves
             
             st.session_state.page = 'menu'
             st.rerun()
@@ -226,26 +97,37 @@ def menu_page():
             st.session_state.page = 'mode2_play'
             st.rerun()
 
-def mode1_select(sheet):
+def _category_view(categories):
+    """
+    (category, best score, is complete) per category, kept in session state.
+    Rebuilt when history_mode1 changes (cat_view is reset) or the cached category tuple is replaced.
+    """
+    cached = st.session_state.get('cat_view')
+    if cached is None or cached[0] is not categories:
+        history = st.session_state.history_mode1
+        view = []
+        for cat in categories:
+            best_score = history.get(cat['_id'], 0)
+            view.append((cat, best_score, best_score >= cat['TotalRequired']))
+        cached = (categories, view)
+        st.session_state.cat_view = cached
+    return cached[1]
+
+def mode1_select():
     st.title("📂 Name All by Category")
     
     try:
-        cat_sheet = sheet.worksheet("1-Category")
-        categories = cat_sheet.get_all_records()
+        categories = reference_tables()["1-Category"]
     except Exception as e:
         st.error(f"Error loading categories: {e}")
         return
     
     # Display Categories as a List of Cards
-    for cat in categories:
-        c_id = str(cat['CategoryID'])
+    for cat, best_score, is_complete in _category_view(categories):
+        c_id = cat['_id']
         req = cat['TotalRequired']
         name = cat['CategoryName']
         
-        # Check History
-        best_score = st.session_state.history_mode1.get(c_id, 0)
-        is_complete = (best_score >= req)
-        
         with st.container(border=True):
             col_info, col_action = st.columns([3, 1])
             
@@ -260,15 +142,17 @@ def mode1_select(sheet):
             
             with col_action:
                 if is_complete:
-                    st.button("Done", key=f"done_{c_id}", disabled=True)
+                    st.button("Done", key=cat['_done_key'], disabled=True)
                 else:
-                    if st.button("Play", key=f"play_{c_id}", type="primary"):
+                    if st.button("Play", key=cat['_play_key'], type="primary"):
                         st.session_state.current_category = cat
-                        st.session_state.m1_answers = [] 
+                        # Resolve this category's answers once for the whole game
+                        st.session_state.valid_answers = answers_index().get(c_id.strip(), {})
+                        reset_mode1_answers()
                         st.session_state.page = 'mode1_play'
                         st.rerun()
 
-def mode1_play(sheet):
+def mode1_play():
     cat = st.session_state.current_category
     if not cat:
         st.session_state.page = 'mode1_select'
@@ -295,24 +179,15 @@ def mode1_play(sheet):
             
             if submitted and user_input:
                 # Validation Logic
-                ans_sheet = sheet.worksheet("1-CategoryAnswer")
-                all_answers = ans_sheet.get_all_records()
-                target_cat_id = str(cat['CategoryID']).strip()
-                
-                valid_answers = [
-                    str(r['CorrectAnswer']).strip().lower() 
-                    for r in all_answers 
-                    if str(r['CategoryID']).strip() == target_cat_id
-                ]
-                
                 clean_input = user_input.strip().lower()
                 
-                if clean_input in valid_answers:
-                    current_found = [x.lower() for x in st.session_state.m1_answers]
-                    if clean_input in current_found:
+                if clean_input in st.session_state.valid_answers:
+                    if clean_input in st.session_state.m1_answers_lower:
                         st.warning(f"⚠️ Duplicate: '{user_input}'")
                     else:
-                        st.session_state.m1_answers.append(user_input.strip().title())
+                        # Show and save the answer as spelled in the sheet
+                        st.session_state.m1_answers.append(st.session_state.valid_answers[clean_input])
+                        st.session_state.m1_answers_lower.add(clean_input)
                         st.rerun()
                 else:
                     st.error(f"❌ '{user_input}' is incorrect.")
@@ -320,7 +195,7 @@ def mode1_play(sheet):
         st.markdown("---")
         if st.button("💾 Give Up & Save Score"):
             new_score = len(st.session_state.m1_answers)
-            c_id = str(cat['CategoryID'])
+            c_id = cat['_id']
             
             # --- SCORING FIX ---
             previous_best = st.session_state.history_mode1.get(c_id, 0)
@@ -329,11 +204,14 @@ def mode1_play(sheet):
                 diff = new_score - previous_best
                 st.session_state.score += diff
                 st.session_state.history_mode1[c_id] = new_score
+                st.session_state.cat_view = None
                 st.success(f"New High Score! Added +{diff} points.")
             else:
                 st.info(f"Saved. (You didn't beat your previous record of {previous_best})")
 
-            save_mode1_session(sheet, cat['CategoryID'], new_score, st.session_state.m1_answers)
+            save_mode1_session(cat['CategoryID'], new_score, st.session_state.m1_answers)
+            flush_writes()
+            reset_mode1_answers()
             
             time.sleep(2)
             st.session_state.page = 'mode1_select' 
@@ -344,7 +222,7 @@ def mode1_play(sheet):
         st.success("🎉 PERFECT SCORE!")
         if st.button("Finish & Save"):
             new_score = len(st.session_state.m1_answers)
-            c_id = str(cat['CategoryID'])
+            c_id = cat['_id']
             
             previous_best = st.session_state.history_mode1.get(c_id, 0)
             
@@ -352,103 +230,164 @@ def mode1_play(sheet):
                 diff = new_score - previous_best
                 st.session_state.score += diff
                 st.session_state.history_mode1[c_id] = new_score
+                st.session_state.cat_view = None
             
-            save_mode1_session(sheet, cat['CategoryID'], len(st.session_state.m1_answers), st.session_state.m1_answers)
+            save_mode1_session(cat['CategoryID'], len(st.session_state.m1_answers), st.session_state.m1_answers)
+            flush_writes()
+            reset_mode1_answers()
             
             st.session_state.page = 'mode1_select'
             st.rerun()
 
-def mode2_play(sheet):
+def _submit_guess(c_id, input_key, next_index):
+    """
+    Form callback for a Mode 2 guess; updates progress and score before the page renders.
+    """
+    session_state = st.session_state
+    guess = session_state.get(input_key, "")
+    state = session_state.m2_progress[c_id]
+    
+    canonical = canonical_names().get(c_id)
+    if canonical is None:
+        # Content was refreshed and this character removed or renamed; the page re-renders from the new list
+        st.toast("⚠️ This character changed while you were playing. Please try the next one.")
+        return
+    
+    if guess.strip().casefold() == canonical:
+        # --- SCORING LOGIC ---
+        points_earned = POINTS_BY_ATTEMPTS[min(state['attempts'], 2)]
+        
+        state['solved'] = True
+        session_state.score += points_earned
+        
+        save_mode2_guess(c_id, state['attempts'], True, guess)
+        st.toast(f"Correct! +{points_earned} Points")
+        session_state.m2_index = next_index
+    else:
+        state['attempts'] += 1
+        save_mode2_guess(c_id, state['attempts'], False, guess)
+        session_state.m2_wrong = c_id # Shown under the form on this run
+
+def _first_unsolved(characters, start, step):
+    """
+    First index from `start` (inclusive), walking by `step`, whose character isn't solved; None if all are.
+    """
+    progress = st.session_state.m2_progress
+    for k in range(len(characters)):
+        j = (start + step * k) % len(characters)
+        if not progress.get(characters[j]['_id'], {}).get('solved'):
+            return j
+    return None
+
+def _set_m2_index(index):
+    st.session_state.m2_index = index
+
+def mode2_play():
     st.title("🕵️ Guess the Character")
     # Updated Instruction Text
     st.info("Guess the character based on the clue. First attempt gives you 3 points. Wrong answers will provide more clues but minus 1 point. Check your spelling!")
     
     try:
-        char_sheet = sheet.worksheet("2-Characters")
-        characters = char_sheet.get_all_records()
+        characters = reference_tables()["2-Characters"]
     except Exception as e:
         st.error(f"Error loading characters: {e}")
         return
 
-    # Use Enumerate for Display Label
-    for i, char in enumerate(characters):
-        c_id = str(char['CharacterID_Old'])
-        correct_name = str(char['CharacterName']).strip()
-        display_label = f"Character #{i + 1}" # Generic Label
-        
-        # Init State
-        if c_id not in st.session_state.m2_progress:
-            st.session_state.m2_progress[c_id] = {'attempts': 0, 'solved': False}
-        
-        state = st.session_state.m2_progress[c_id]
+    if not characters:
+        st.info("No characters available yet.")
+        return
+
+    session_state = st.session_state
+    progress = session_state.m2_progress
+    
+    # Render only the active character instead of a form for every row,
+    # moving forward past solved ones (unless everything is solved)
+    i = session_state.m2_index % len(characters)
+    unsolved = _first_unsolved(characters, i, 1)
+    if unsolved is not None:
+        i = unsolved
+    if i != session_state.m2_index:
+        session_state.m2_index = i
+    char = characters[i]
+    c_id = char['_id']
+    correct_name = str(char['CharacterName']).strip()
+    display_label = f"Character #{i + 1}" # Generic Label
+    next_index = (i + 1) % len(characters)
+    prev_index = _first_unsolved(characters, i - 1, -1)
+    if prev_index is None:
+        prev_index = (i - 1) % len(characters)
+    
+    # Init State
+    state = progress.setdefault(c_id, {'attempts': 0, 'solved': False})
+    
+    st.caption(f"Character {i + 1} of {len(characters)}")
+    
+    with st.container(border=True):
+        col_clues, col_interaction = st.columns([3, 1])
         
-        with st.container(border=True):
-            col_clues, col_interaction = st.columns([3, 1])
-            
-            with col_clues:
-                if state['solved']:
-                    st.success(f"✅ **SOLVED:** {correct_name}")
-                else:
-                    st.markdown(f"**{display_label}**") # Show Generic Label
-                    clues = [char['Clue1'], char['Clue2'], char['Clue3']]
-                    visible_count = min(state['attempts'] + 1, 3)
-                    
-                    for k in range(visible_count):
-                        st.write(f"🔹 *Clue {k+1}:* {clues[k]}")
+        with col_clues:
+            if state['solved']:
+                st.success(f"✅ **SOLVED:** {correct_name}")
+            else:
+                st.markdown(f"**{display_label}**") # Show Generic Label
+                clues = [char['Clue1'], char['Clue2'], char['Clue3']]
+                visible_count = min(state['attempts'] + 1, 3)
+                
+                for k in range(visible_count):
+                    st.write(f"🔹 *Clue {k+1}:* {clues[k]}")
+                
+                if state['attempts'] >= 2:
+                    st.warning("⚠️ Final Clue!")
+
+        with col_interaction:
+            if not state['solved']:
+                # WRAP IN FORM TO ENABLE ENTER KEY
+                with st.form(key=char['_form_key'], clear_on_submit=False):
+                    st.text_input("Guess", key=char['_input_key'])
+                    # Handled in a callback, which runs before the form's own rerun, so no extra st.rerun()
+                    st.form_submit_button("Submit", on_click=_submit_guess, args=(c_id, char['_input_key'], next_index))
                     
-                    if state['attempts'] >= 2:
-                        st.warning("⚠️ Final Clue!")
-
-            with col_interaction:
-                if not state['solved']:
-                    # WRAP IN FORM TO ENABLE ENTER KEY
-                    with st.form(key=f"form_{c_id}", clear_on_submit=False):
-                        guess = st.text_input("Guess", key=f"input_{c_id}")
-                        submitted = st.form_submit_button("Submit")
-                        
-                        if submitted:
-                            clean_guess = guess.strip().lower()
-                            clean_answer = correct_name.lower()
-                            
-                            if clean_guess == clean_answer:
-                                # --- SCORING LOGIC ---
-                                points_map = {0: 3, 1: 2}
-                                points_earned = points_map.get(state['attempts'], 1)
-                                
-                                st.session_state.m2_progress[c_id]['solved'] = True
-                                st.session_state.score += points_earned
-                                
-                                save_mode2_guess(sheet, c_id, state['attempts'], True, guess)
-                                st.toast(f"Correct! +{points_earned} Points")
-                                st.rerun()
-                            else:
-                                st.error("Wrong")
-                                st.session_state.m2_progress[c_id]['attempts'] += 1
-                                save_mode2_guess(sheet, c_id, state['attempts'], False, guess)
-                                st.rerun()
+                    if session_state.pop('m2_wrong', None) == c_id:
+                        st.error("Wrong")
+
+    col_prev, col_next = st.columns(2)
+    with col_prev:
+        st.button("⬅️ Previous", key="m2_prev", use_container_width=True, on_click=_set_m2_index, args=(prev_index,))
+    with col_next:
+        st.button("Next ➡️", key="m2_next", use_container_width=True, on_click=_set_m2_index, args=(next_index,))
 
 # --- MAIN APP ---
 
 def main():
     try:
-        sheet = connect_to_sheet()
+        connect_to_sheet() # Opened up front so a bad connection is reported here, before any page runs
     except Exception as e:
         st.error("❌ Database Connection Failed")
         st.code(str(e))
         return
 
+    check_writes()
+
+    # Every page transition flushes buffered writes, whichever button caused it;
+    # otherwise the buffer goes out on this rerun once its oldest row has waited the flush interval
+    if st.session_state.page != st.session_state.get('last_page'):
+        flush_writes()
+        st.session_state.last_page = st.session_state.page
+    else:
+        flush_writes_if_due()
+
     render_sidebar()
 
     if st.session_state.page == 'home':
-        home_page(sheet)
+        home_page()
     elif st.session_state.page == 'menu':
         menu_page()
     elif st.session_state.page == 'mode1_select':
-        mode1_select(sheet)
+        mode1_select()
     elif st.session_state.page == 'mode1_play':
-        mode1_play(sheet)
+        mode1_play()
     elif st.session_state.page == 'mode2_play':
-        mode2_play(sheet)
+        mode2_play()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,580 @@
+"""
+Google Sheets access, write buffering and the shared sidebar for the quiz app.
+"""
+import streamlit as st
+import concurrent.futures
+import csv
+import datetime
+import io
+import itertools
+import sys
+import time
+import uuid
+
+# --- CONNECT TO GOOGLE SHEETS ---
+@st.cache_resource(show_spinner=False)
+def _get_client():
+    """
+    Authorized gspread client with a pooled, retrying HTTP session, shared by every rerun.
+    """
+    # Heavy Google/HTTP imports live here so they only load once, on first connect
+    import gspread
+    from google.auth.transport.requests import AuthorizedSession
+    from google.oauth2.service_account import Credentials
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+    
+    scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+    # Attempt to load from Streamlit Secrets (for Cloud Deployment)
+    if "gcp_service_account" in st.secrets:
+        creds_dict = dict(st.secrets["gcp_service_account"])
+        creds = Credentials.from_service_account_info(creds_dict, scopes=scope)
+    # Fallback to local file (for Local Testing)
+    else:
+        creds = Credentials.from_service_account_file("credentials.json", scopes=scope)
+    
+    # Reuse one pooled keep-alive connection for every Sheets call, with backoff on 429/5xx.
+    # The session is built and mounted here, then handed to gspread, so no default session is created and discarded.
+    # 429 is left to _with_retry, so the two layers don't multiply: this chain sleeps at most 0.3+0.6+1.2 = 2.1s
+    retry = Retry(
+        total=3,
+        backoff_factor=0.3,
+        status_forcelist=[500, 502, 503, 504],
+        allowed_methods=frozenset(['GET', 'POST', 'PUT']), # Sheets reads are GET, appends POST, updates PUT
+        raise_on_status=False,
+        respect_retry_after_header=False, # A server-sent Retry-After could stall a rerun far past the budget
+    )
+    session = AuthorizedSession(creds)
+    session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry))
+    session.headers['Connection'] = 'keep-alive'
+    
+    return gspread.Client(auth=creds, session=session)
+
+@st.cache_resource(show_spinner=False)
+def _get_spreadsheet(_client):
+    """
+    The game spreadsheet. Cached apart from the client so a failed open doesn't redo authorization.
+    """
+    return _client.open("Bible Character Game  - Python")
+
+def connect_to_sheet():
+    """
+    The cached Spreadsheet handle used by every page.
+    """
+    return _get_spreadsheet(_get_client())
+
+def _http_session(client):
+    """
+    The authorized requests session behind a gspread client (gspread 6 keeps it on http_client).
+    """
+    return getattr(client, 'http_client', client).session
+
+def _with_retry(fn, *args, tries=3, **kwargs):
+    """
+    Calls fn, retrying a gspread APIError 429 with exponential backoff.
+    The HTTP adapter handles 5xx and connection errors; throttling is only retried here.
+    Worst case: 0.9s of sleeping on sustained 429s, about 7s if every try also exhausts the adapter's 2.1s chain.
+    """
+    from gspread.exceptions import APIError
+    
+    for attempt in range(tries):
+        try:
+            return fn(*args, **kwargs)
+        except APIError as e:
+            if e.response.status_code != 429 or attempt == tries - 1:
+                raise
+            time.sleep(2 ** attempt * 0.3)
+
+@st.cache_resource(show_spinner=False)
+def get_ws(title):
+    """
+    Cached worksheet handle, so repeat writes skip the metadata lookup behind sheet.worksheet().
+    """
+    return connect_to_sheet().worksheet(title)
+
+# Read-only game content, loaded together and shared by every session
+REFERENCE_RANGES = {
+    "1-Category": "'1-Category'!A2:C", # Only CategoryID, CategoryName, TotalRequired are used
+    "1-CategoryAnswer": "1-CategoryAnswer",
+    "2-Characters": "2-Characters",
+}
+
+@st.cache_data(persist="disk", show_spinner=False)
+def _reference_values():
+    """
+    Raw values of the reference tabs, fetched in one batchGet and pickled to disk,
+    so a restarted app doesn't have to download them again.
+    Persisted caches don't support a TTL; refresh_reference_data() clears this.
+    """
+    resp = _with_retry(connect_to_sheet().values_batch_get, list(REFERENCE_RANGES.values()), params={'valueRenderOption': 'UNFORMATTED_VALUE'})
+    return {name: vr.get('values', []) for name, vr in zip(REFERENCE_RANGES, resp.get('valueRanges', []))}
+
+@st.cache_resource(show_spinner=False)
+def reference_tables():
+    """
+    The reference tabs as { 'sheet_title': tuple of records }.
+    Kept in st.cache_resource so reruns share one object instead of getting a fresh copy each time.
+    """
+    values = _reference_values()
+    
+    # Categories come back header-less and positional, so skip the dict-per-header conversion
+    categories = tuple(
+        {'CategoryID': r[0], 'CategoryName': r[1], 'TotalRequired': int(r[2])}
+        for r in values.get("1-Category", []) if len(r) >= 3
+    )
+    characters = tuple(_rows_to_dicts(values.get("2-Characters", [])))
+    
+    # String IDs and widget keys are built once here rather than formatted on every render
+    for cat in categories:
+        cat['_id'] = c_id = str(cat['CategoryID'])
+        cat['_play_key'] = sys.intern("play_" + c_id)
+        cat['_done_key'] = sys.intern("done_" + c_id)
+    for char in characters:
+        char['_id'] = c_id = str(char['CharacterID_Old'])
+        char['_form_key'] = sys.intern("form_" + c_id)
+        char['_input_key'] = sys.intern("input_" + c_id)
+    
+    return {
+        "1-Category": categories,
+        "1-CategoryAnswer": tuple(_rows_to_dicts(values.get("1-CategoryAnswer", []))),
+        "2-Characters": characters,
+    }
+
+@st.cache_resource(show_spinner=False)
+def answers_index():
+    """
+    Maps each CategoryID to { lowercased answer: answer as written in the sheet }.
+    Keys are normalized and interned once here, so submits never re-strip or re-lower them.
+    """
+    idx = {}
+    for r in reference_tables()["1-CategoryAnswer"]:
+        display = str(r['CorrectAnswer']).strip()
+        idx.setdefault(str(r['CategoryID']).strip(), {})[sys.intern(display.lower())] = display
+    return idx
+
+@st.cache_resource(show_spinner=False)
+def canonical_names():
+    """
+    Maps each CharacterID_Old to its casefolded name, for comparing Mode 2 guesses.
+    """
+    return {str(c['CharacterID_Old']): sys.intern(str(c['CharacterName']).strip().casefold()) for c in reference_tables()["2-Characters"]}
+
+def refresh_reference_data():
+    """
+    Drops every cached copy of the game content, including the one on disk.
+    """
+    _reference_values.clear()
+    reference_tables.clear()
+    answers_index.clear()
+    canonical_names.clear()
+
+# --- HELPER FUNCTIONS ---
+
+# Mode 2 Scoring Logic: 0 attempts=3pts, 1 attempt=2pts, >=2 attempts=1pt (index with min(attempts, 2))
+POINTS_BY_ATTEMPTS = (3, 2, 1)
+
+def _rows_to_dicts(values):
+    """
+    Turns a values-API range (header row first) into records like get_all_records().
+    """
+    if not values:
+        return []
+    header = values[0]
+    width = len(header)
+    # The API trims trailing empty cells, so pad short rows back to the header width
+    return [dict(zip(header, row + [""] * (width - len(row)))) for row in values[1:]]
+
+# Both session tabs store UserEmail third (see save_mode1_session / save_mode2_guess)
+SESSION_USER_COLUMN = "C"
+
+def _query_user_rows(sheet, sheet_title, user_id):
+    """
+    Fetches only this user's rows (header first) from a session tab.
+    Filtering runs server-side through the Sheets query endpoint, keyed on SESSION_USER_COLUMN.
+    Returns None if the query can't be run or its answer isn't the tab's CSV, so callers can fall back to a full read.
+    """
+    # The query language has no escape sequences, so pick whichever quote the ID doesn't use
+    if "'" not in user_id:
+        literal = f"'{user_id}'"
+    elif '"' not in user_id:
+        literal = f'"{user_id}"'
+    else:
+        return None
+
+    try:
+        resp = _http_session(sheet.client).get(
+            f"https://docs.google.com/spreadsheets/d/{sheet.id}/gviz/tq",
+            params={'sheet': sheet_title, 'headers': 1, 'tqx': 'out:csv', 'tq': f"select * where {SESSION_USER_COLUMN} = {literal}"},
+        )
+        resp.raise_for_status()
+    except Exception:
+        return None
+    # A 2xx can still be a login/redirect page or a gviz error body; only real CSV of the tab counts
+    if not resp.headers.get('Content-Type', '').startswith('text/csv'):
+        return None
+    rows = list(csv.reader(io.StringIO(resp.text)))
+    if not rows or 'UserEmail' not in rows[0]:
+        return None
+    return rows
+
+def _read_session_tab(sheet, sheet_title):
+    """
+    Every row of a session tab (header first) through the values API.
+    A 400 means the tab doesn't exist yet, which is "no history" for that tab only; other errors raise.
+    """
+    from gspread.exceptions import APIError
+    
+    try:
+        return _with_retry(sheet.values_get, sheet_title).get('values', [])
+    except APIError as e:
+        if e.response.status_code != 400:
+            raise
+        return []
+
+def _user_rows_only(values, user_id):
+    """
+    The header plus this user's rows from a full session-tab read.
+    """
+    if not values or 'UserEmail' not in values[0]:
+        return values[:1]
+    i_user = values[0].index('UserEmail')
+    return values[:1] + [row for row in values[1:] if len(row) > i_user and row[i_user] == user_id]
+
+@st.cache_resource
+def _history_generations():
+    """
+    Per-user counter bumped whenever that user's rows are written, so stale history cache entries are skipped.
+    """
+    return {}
+
+def _bump_generation(generations, user_id):
+    """
+    Moves user_id to a new history cache generation. Takes the dict so writer threads can call it.
+    """
+    generations[user_id] = generations.get(user_id, 0) + 1
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def load_user_rows(user_id, generation):
+    """
+    This user's Mode1_Sessions and Mode2_Sessions rows (header first), cached per user and generation.
+    This process's own writes bump the generation, so the TTL only bounds staleness from edits made elsewhere.
+    A failed read raises instead of returning, so it is never cached.
+    """
+    sheet = connect_to_sheet()
+    
+    # Only this user's rows are transferred when the query endpoint is available.
+    # The endpoint reads one tab per request, so send both at once to pay a single round-trip.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as pool:
+        m1_future = pool.submit(_query_user_rows, sheet, "Mode1_Sessions", user_id)
+        m2_future = pool.submit(_query_user_rows, sheet, "Mode2_Sessions", user_id)
+    m1_values, m2_values = m1_future.result(), m2_future.result()
+    
+    # Fallback, per tab: only a tab whose query failed is read in full, so a good result is kept.
+    # The full read is cut down to this user's rows before it is cached, so entries stay per-user sized.
+    if m1_values is None:
+        m1_values = _user_rows_only(_read_session_tab(sheet, "Mode1_Sessions"), user_id)
+    if m2_values is None:
+        m2_values = _user_rows_only(_read_session_tab(sheet, "Mode2_Sessions"), user_id)
+    
+    return m1_values, m2_values
+
+def fetch_user_history(user_id):
+    """
+    Calculates Total Score from Database and loads progress.
+    """
+    from google.auth.exceptions import RefreshError
+    from gspread.exceptions import APIError
+    
+    total_calculated_score = 0
+    
+    try:
+        m1_values, m2_values = load_user_rows(user_id, _history_generations().get(user_id, 0))
+    except (APIError, RefreshError, *_network_errors()) as e:
+        # Missing tabs are already handled per tab; this is throttling that outlasted
+        # every retry, an outage or a failed token refresh, which must not pass for "no history".
+        st.warning(f"Couldn't load your previous progress, so your score may be incomplete. ({e})")
+        m1_values, m2_values = [], []
+    
+    # Rows are read positionally against the header; no per-row dicts are built.
+    # Rows shorter than the last needed column are skipped (the API trims empty trailing cells).
+    # Both the query endpoint (CSV) and the values API (formatted values) return every cell as a str,
+    # so cells are compared as-is without a str() per row.
+    
+    # 1. Mode 1 History & Score
+    try:
+        header = m1_values[0] if m1_values else []
+        i_user, i_cat, i_score = (header.index(col) for col in ('UserEmail', 'CategoryID', 'Score'))
+        width = max(i_user, i_cat, i_score)
+        
+        history_map = {}
+        
+        # Single pass: filter for current user and keep the best score per category
+        for row in m1_values[1:]:
+            if len(row) <= width or row[i_user] != user_id:
+                continue
+            c_id = row[i_cat]
+            try:
+                score = int(row[i_score])
+            except ValueError:
+                score = 0
+                
+            if score > history_map.get(c_id, -1):
+                history_map[c_id] = score
+        
+        st.session_state.history_mode1 = history_map
+        st.session_state.cat_view = None
+        # Add Mode 1 points to total
+        total_calculated_score += sum(history_map.values())
+        
+    except ValueError:
+        pass # Tab is missing an expected column
+
+    # 2. Mode 2 History & Score
+    try:
+        header = m2_values[0] if m2_values else []
+        i_user, i_char, i_attempts, i_solved = (header.index(col) for col in ('UserEmail', 'CharacterID', 'CurrentAttempts', 'IsSolved'))
+        width = max(i_user, i_char, i_attempts, i_solved)
+        
+        # Single pass: keep rows that match the user AND IsSolved = TRUE, reduced to
+        # { char_id: raw attempts } for the first solve (later solves are ignored)
+        first_solves = {}
+        for row in m2_values[1:]:
+            if len(row) <= width or row[i_user] != user_id or row[i_solved].upper() != "TRUE":
+                continue
+            first_solves.setdefault(row[i_char], row[i_attempts])
+
+        # Unparseable attempts count as 2 (1pt), as for a data error
+        m2_points = sum(POINTS_BY_ATTEMPTS[min(int(raw) if raw.isdecimal() else 2, 2)] for raw in first_solves.values())
+        total_calculated_score += m2_points
+        
+        # Pre-fill m2_progress so UI shows "Solved" immediately (one bulk merge, attempts kept)
+        progress = st.session_state.m2_progress
+        progress.update({c_id: {**progress.get(c_id, {'attempts': 0}), 'solved': True} for c_id in first_solves})
+
+    except ValueError:
+        pass # Tab is missing an expected column
+
+    # SET THE GLOBAL SCORE
+    st.session_state.score = total_calculated_score
+
+# Rows buffered per worksheet before a flush is forced
+WRITE_FLUSH_THRESHOLD = 8
+# Seconds a buffered row may wait before the next rerun sends it
+WRITE_FLUSH_INTERVAL = 10
+
+def _queue_write(sheet_title, row):
+    """
+    Buffers a row in session state instead of appending it straight away.
+    """
+    rows = st.session_state.pending_writes.setdefault(sheet_title, [])
+    rows.append(row)
+    # When the oldest buffered row was queued; flush_writes_if_due measures from here
+    st.session_state.setdefault('pending_since', time.monotonic())
+    if len(rows) >= WRITE_FLUSH_THRESHOLD:
+        flush_writes()
+
+@st.cache_resource
+def _writer():
+    """
+    Shared background pool, so Sheets writes don't hold up the rerun.
+    """
+    return concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix="sheets-writer")
+
+def flush_writes():
+    """
+    Hands every buffered row to the writer pool as one append_rows call per worksheet.
+    """
+    pending = st.session_state.get('pending_writes', {})
+    futures = st.session_state.setdefault('write_futures', [])
+    st.session_state.pop('pending_since', None)
+    
+    # This user's cached history no longer matches the sheet. Bumped now and again when each
+    # append finishes, so rows cached by a login while the write was in flight are dropped once it lands.
+    generations = _history_generations()
+    user_id = st.session_state.get('user_id', "")
+    if any(pending.values()):
+        _bump_generation(generations, user_id)
+    
+    for sheet_title in list(pending):
+        rows = pending.pop(sheet_title)
+        if rows:
+            # Resolve the worksheet here: cached Streamlit functions need the script thread.
+            # A failed lookup is handled like a failed append, so the rows aren't lost.
+            try:
+                ws = _with_retry(get_ws, sheet_title)
+            except Exception as e:
+                _handle_failed_write(sheet_title, rows, e)
+                continue
+            # Anchor table detection at A1: the session tabs hold one table starting there
+            future = _writer().submit(
+                _with_retry, ws.append_rows, rows,
+                value_input_option='RAW', insert_data_option='INSERT_ROWS', table_range='A1',
+            )
+            # Runs on the writer thread, so it gets the generations dict rather than calling the cached function
+            future.add_done_callback(lambda _: _bump_generation(generations, user_id))
+            # Keep the rows with the future so a failed write can be queued again
+            futures.append((future, sheet_title, rows))
+
+def flush_writes_if_due():
+    """
+    Flushes when the oldest buffered row has waited WRITE_FLUSH_INTERVAL seconds or more.
+    """
+    since = st.session_state.get('pending_since')
+    if since is not None and time.monotonic() - since >= WRITE_FLUSH_INTERVAL:
+        flush_writes()
+
+def _network_errors():
+    """
+    Failures of a Sheets call that aren't an APIError: dropped connections, timeouts and token transport.
+    """
+    from google.auth.exceptions import TransportError
+    import requests
+    
+    return (requests.ConnectionError, requests.Timeout, TransportError)
+
+def _is_transient(exc):
+    """
+    True for write failures worth sending again: throttling, server errors and dropped connections.
+    """
+    from gspread.exceptions import APIError
+    
+    if isinstance(exc, APIError):
+        status = exc.response.status_code
+        return status == 429 or status >= 500
+    return isinstance(exc, _network_errors())
+
+def _handle_failed_write(sheet_title, rows, exc):
+    """
+    Transient failures put their rows back at the front of the buffer; anything else (no edit
+    access, a missing tab) would only fail again, so those rows are reported once and dropped.
+    """
+    if _is_transient(exc):
+        st.session_state.setdefault('pending_writes', {}).setdefault(sheet_title, [])[:0] = rows
+        # Re-queued rows wait a full interval again, which spaces out the retries
+        st.session_state.setdefault('pending_since', time.monotonic())
+        st.toast(f"⚠️ Couldn't save to {sheet_title}, will retry: {exc}")
+    else:
+        st.error(f"Couldn't save {len(rows)} row(s) to {sheet_title}, and they were discarded: {exc}")
+
+def check_writes():
+    """
+    Reports background writes that failed since the last rerun, via _handle_failed_write.
+    """
+    still_running = []
+    for future, sheet_title, rows in st.session_state.get('write_futures', []):
+        if not future.done():
+            still_running.append((future, sheet_title, rows))
+        elif future.exception() is not None:
+            _handle_failed_write(sheet_title, rows, future.exception())
+    st.session_state.write_futures = still_running
+    # Rows that held up Log Out have since gone out (or been dropped), so stop warning about them
+    if not still_running and not any(st.session_state.get('pending_writes', {}).values()):
+        st.session_state.pop('logout_blocked', None)
+
+def _wait_for_writes():
+    """
+    Blocks until this session's background writes have finished.
+    """
+    concurrent.futures.wait([future for future, _, _ in st.session_state.get('write_futures', [])])
+
+@st.cache_resource
+def _id_counter():
+    """
+    Process-wide counter for row IDs; the uuid suffix keeps them unique across restarts.
+    """
+    return itertools.count()
+
+# Mode1_Sessions rows are padded to this many columns (5 fixed + up to 15 answers)
+MODE1_ROW_WIDTH = 20
+
+def save_mode1_session(category_id, score, answers):
+    # Same "YYYY-MM-DD HH:MM:SS" text as strftime, without parsing a format string
+    timestamp = datetime.datetime.now().isoformat(" ", "seconds")
+    session_id = f"SESS-{next(_id_counter())}-{uuid.uuid4().hex[:6]}"
+    
+    # Use user_id (Name_PIN) for storage
+    row_data = [session_id, category_id, st.session_state.user_id, timestamp, score, *answers]
+    # A negative count yields [], so rows that are already wide enough are left alone
+    row_data += [""] * (MODE1_ROW_WIDTH - len(row_data))
+    _queue_write("Mode1_Sessions", row_data)
+
+def save_mode2_guess(char_id, attempts, solved, guess):
+    guess_id = f"GUESS-{next(_id_counter())}-{uuid.uuid4().hex[:6]}-{char_id}"
+    row_data = [guess_id, char_id, st.session_state.user_id, attempts, str(solved).upper(), guess]
+    _queue_write("Mode2_Sessions", row_data)
+
+def reset_mode1_answers():
+    """
+    Starts a fresh Mode 1 round. The answer list and its lowercased set are always cleared together.
+    """
+    st.session_state.m1_answers = []
+    st.session_state.m1_answers_lower = set()
+
+# --- NAVIGATION SIDEBAR ---
+
+# Sidebar radio label -> page
+NAV_PAGES = {
+    "🏠 Home": 'menu',
+    "📂 Name All by Category": 'mode1_select',
+    "🕵️ Guess the Character": 'mode2_play',
+}
+# Page -> label shown as selected. mode1_play has none, so picking Category from it still fires on_change
+NAV_OPTION_FOR_PAGE = {page: label for label, page in NAV_PAGES.items()}
+
+def _on_nav():
+    page = NAV_PAGES[st.session_state.nav_radio]
+    if page == 'mode1_select':
+        reset_mode1_answers()
+    st.session_state.page = page
+
+# Everything tied to the logged-in player; Log Out drops only these, and app.py's defaults refill them.
+# The shared caches (reference content, login history) are left alone, so logging back in hits them.
+USER_SESSION_KEYS = (
+    'page', 'score', 'user_id', 'display_name',
+    'history_mode1', 'history_mode2', 'cat_view',
+    'm1_answers', 'm1_answers_lower', 'current_category', 'valid_answers',
+    'm2_progress', 'm2_index', 'm2_wrong',
+)
+
+def _log_out():
+    """
+    Drops the player's session keys and any writes still buffered for them, then returns to the login page.
+    """
+    for key in (*USER_SESSION_KEYS, 'pending_writes', 'pending_since', 'write_futures', 'logout_blocked'):
+        st.session_state.pop(key, None)
+    st.rerun()
+
+def render_sidebar():
+    if st.session_state.user_id:
+        with st.sidebar:
+            st.header(f"👤 {st.session_state.display_name}")
+            st.caption(f"ID: {st.session_state.user_id}")
+            st.metric("TOTAL SCORE", st.session_state.score)
+            
+            st.divider()
+            st.subheader("Navigation")
+            
+            # One radio instead of a button per page; it mirrors the current page on every run
+            st.session_state.nav_radio = NAV_OPTION_FOR_PAGE.get(st.session_state.page)
+            st.radio("Go to", tuple(NAV_PAGES), key="nav_radio", on_change=_on_nav, label_visibility="collapsed")
+            
+            st.divider()
+            
+            if st.button("🔄 Refresh content", use_container_width=True):
+                refresh_reference_data()
+                st.rerun()
+            
+            if st.button("Log Out", type="secondary", use_container_width=True):
+                # Push buffered guesses out before the session is wiped
+                flush_writes()
+                _wait_for_writes()
+                check_writes()
+                # Don't wipe rows that still have to reach the sheet unless the player says so
+                st.session_state.logout_blocked = any(st.session_state.pending_writes.values())
+                if not st.session_state.logout_blocked:
+                    _log_out()
+            
+            if st.session_state.get('logout_blocked'):
+                st.error("Some progress hasn't been saved yet. Try logging out again, or leave without saving it.")
+                if st.button("Log out without saving", use_container_width=True):
+                    _log_out()